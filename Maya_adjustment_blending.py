@@ -16,21 +16,19 @@ This is a Maya adaptation of the Adjustment Blending script (by Dan Lowe in Mobu
 
 import maya.cmds as cmds
 import maya.OpenMaya as om
+import maya.OpenMayaAnim as oma
+import numpy as np
 
-
-def get_key_pairs_from_keys(obj, keys):
+def get_key_pairs_from_keys(curve_fn, keys):
     """
     Groups pairs of keys from the keys in an animation curve, between which it will run an independent adjustment blend
     (allows adjustment blend to work with multiple key poses on the layer).
+    The keys are the curve's own key times, so their values can be read straight off the keys by index.
+    Yields (start time, stop time, start value, stop value) for each pair.
     """
-    key_pairs_list = []
+    key_values = [curve_fn.value(i) for i in range(len(keys))]
     for i in range(len(keys) - 1):
-        start_key_time = keys[i]
-        start_key_value = cmds.keyframe(obj, q=1, eval=1, time=(start_key_time, start_key_time))
-        stop_key_time = keys[i + 1]
-        stop_key_value = cmds.keyframe(obj, q=1, eval=1, time=(stop_key_time, stop_key_time))
-        key_pairs_list.append([start_key_time, stop_key_time, start_key_value[0], stop_key_value[0]])
-    return key_pairs_list
+        yield keys[i], keys[i + 1], key_values[i], key_values[i + 1]
 
 
 def get_all_layers():
@@ -41,111 +39,195 @@ def get_all_layers():
         layers.append(root_layer)
         children = cmds.animLayer(root_layer, q=True, c=True)
         if children:
-            for child in children:
-                layers.append(child)
+            layers.extend(children)
     return layers
 
 
-def evaluate_key_values_for_key_pair_timespan(obj, start_time, stop_time):
+def get_curve_mobject(obj, layer):
+    """
+    Returns the MObject of the animation curve driving obj on the given layer, or None if it isn't animated on that
+    layer. Resolving it once lets the reads work on the curve directly, without going through cmds.
+    """
+    curve_names = cmds.animLayer(layer, q=True, findCurveForPlug=obj)
+    if not curve_names:
+        return None
+    selection = om.MSelectionList()
+    selection.add(curve_names[0])
+    curve_node = om.MObject()
+    selection.getDependNode(0, curve_node)
+    return curve_node
+
+
+def evaluate_key_values_for_key_pair_timespan(curve_fn, start_time, stop_time):
     """
     Reads the per frame values from an fcurve (doesn't require keys to be on those frames).
+    Samples every 0.2 frames, landing exactly on both keys, and returns the sample times and values as arrays.
     """
-    key_pair_span_values = []
-    root_layer = cmds.animLayer(q=True, r=True)
-    set_layer_as_preferred(root_layer)
-    current = start_time
-    while not current > stop_time:
-        values = cmds.keyframe(obj, q=1, eval=1, t=(current, current))
-        key_pair_span_values.append([current, values[0]])
-        current += 0.2
-    return key_pair_span_values
+    sample_count = max(int(round((stop_time - start_time) / 0.2)) + 1, 2)
+    times = np.linspace(start_time, stop_time, sample_count)
+    time_unit = om.MTime.uiUnit()
+    values = np.array([curve_fn.evaluate(om.MTime(float(current), time_unit)) for current in times])
+    return times, values
 
 
-def set_layer_as_preferred(layer):
+def get_ui_unit_scale(curve_fn):
+    """
+    Returns the factor that converts the curve's values from internal units (what the API reads) into the UI units
+    that cmds works with.
+    """
+    curve_type = curve_fn.animCurveType()
+    if curve_type == oma.MFnAnimCurve.kAnimCurveTA:
+        return om.MAngle(1.0).asUnits(om.MAngle.uiUnit())
+    if curve_type == oma.MFnAnimCurve.kAnimCurveTL:
+        return om.MDistance(1.0).asUnits(om.MDistance.uiUnit())
+    return 1.0
+
+
+def set_key_values_for_timespan(curve_fn, times, values):
+    """
+    Keys the given (internal unit) values onto an fcurve. This goes through cmds.setKeyframe on the curve itself,
+    so that the edit is recorded in the undo queue.
+    """
+    curve_name = curve_fn.name()
+    ui_values = np.asarray(values) * get_ui_unit_scale(curve_fn)
+    for key_time, key_value in zip(times, ui_values):
+        cmds.setKeyframe(curve_name, value=float(key_value), t=(float(key_time), float(key_time)))
+
+
+def set_layer_as_preferred(layer, layers=None):
     """
     Sets the given layer as the preferred animation layer.
+    If the scene's layers have already been queried they can be passed in, to save querying them again.
     """
-    layers = get_all_layers()
+    if layers is None:
+        layers = get_all_layers()
     for item in layers:
         if item != layer:
-            cmds.animLayer(f'{item}', e=1, preferred=0)
+            cmds.animLayer(item, e=1, preferred=0)
         else:
-            cmds.animLayer(f'{layer}', e=1, preferred=1)
+            cmds.animLayer(layer, e=1, preferred=1)
 
 
-def get_change_values_frac(span_values):
+def get_change_values_frac(base_values):
     """
     Finds the fraction (0-1) of change that occurred on the base layer curve, for the key pair.
     """
-    change_values = [0.0]
-    total_base_layer_change = []
-    for i in range(len(span_values) - 1):
-        frame_change_value = abs(span_values[i + 1][1] - span_values[i][1])
-        change_values.append(frame_change_value)
-    total_base_layer_change = sum(change_values)
-    frac_values = []
-    for i in range(len(change_values)):
-        if total_base_layer_change != 0:
-            frac_values.append([span_values[i][0], change_values[i] / total_base_layer_change])
+    change_values = np.empty_like(base_values)
+    change_values[0] = 0.0
+    change_values[1:] = np.abs(np.diff(base_values))
+    total_base_layer_change = change_values.sum()
+    if total_base_layer_change:
+        frac_values = change_values / total_base_layer_change
+    else:
+        frac_values = np.zeros_like(change_values)
     return frac_values, total_base_layer_change
 
 
-def adjustment_blend_object(obj):
+def get_pose_values_for_key_pair(base_values, start_value, stop_value):
+    """
+    Spreads the change between a pair of pose keys over the span, following the change on the base layer.
+    Returns None if there's no change on the base layer to follow.
+    """
+    frac_values, total_base_layer_change = get_change_values_frac(base_values)
+    if not total_base_layer_change:
+        return None
+    # The signed change between the keys, so it moves towards the stop key in either direction.
+    pose_layer_change = stop_value - start_value
+    return start_value + np.cumsum(pose_layer_change * frac_values)
+
+
+def get_adjustment_blend_values(base_curve_fn, key_pairs):
+    """
+    Works out the adjustment blended pose layer keys for all the key pairs of a curve, without changing anything.
+    Returns the key times and values for the whole curve, ready to be keyed onto the pose layer curve.
+    """
+    pose_times = []
+    pose_values = []
+    for start_time, stop_time, start_value, stop_value in key_pairs:
+        values = None
+        # Held poses stay held whatever the base layer does, so their spans aren't sampled at all.
+        if start_value != stop_value:
+            times, base_values = evaluate_key_values_for_key_pair_timespan(base_curve_fn, start_time, stop_time)
+            values = get_pose_values_for_key_pair(base_values, start_value, stop_value)
+        if values is None:
+            # Held pose, or nothing to follow on the base layer, so just keep the pose keys.
+            times = np.array([start_time, stop_time])
+            values = np.array([start_value, stop_value])
+        if pose_times and times[0] <= pose_times[-1][-1]:
+            # The previous key pair already wrote the key this one starts on.
+            times, values = times[1:], values[1:]
+        pose_times.append(times)
+        pose_values.append(values)
+    return np.concatenate(pose_times), np.concatenate(pose_values)
+
+
+def adjustment_blend_object(obj, layers=None, root_layer=None, pose_layer=None):
     """
     The main adjustment blend function that does everything else.
     This is what you'd run if you were just adjustment blending a single object.
+    The layers are looked up from the scene unless they're passed in (as adjustment_blend_character does, in which
+    case it's also left to the caller to make the pose layer preferred once it's done).
     """
-    if len(get_all_layers()) > 1:
-        pose_layer = get_all_layers()[::-1][0]
-        root_layer = cmds.animLayer(q=True, r=True)
-        set_layer_as_preferred(root_layer)
-        curve_name = cmds.keyframe(obj, q=True, name=1)
-        if curve_name:
-            set_layer_as_preferred(pose_layer)
-            pose_keys = cmds.keyframe(obj, q=1)
+    standalone = layers is None
+    if standalone:
+        layers = get_all_layers()
+    if len(layers) > 1:
+        if pose_layer is None:
+            pose_layer = layers[-1]
+        if root_layer is None:
+            root_layer = layers[0]
+        base_curve = get_curve_mobject(obj, root_layer)
+        pose_curve = get_curve_mobject(obj, pose_layer)
+        if base_curve is not None and pose_curve is not None:
+            base_curve_fn = oma.MFnAnimCurve(base_curve)
+            pose_curve_fn = oma.MFnAnimCurve(pose_curve)
+            time_unit = om.MTime.uiUnit()
+            pose_keys = [pose_curve_fn.time(i).asUnits(time_unit) for i in range(pose_curve_fn.numKeys())]
             if pose_keys:
                 if len(pose_keys) > 1:
-                    key_pair_list = get_key_pairs_from_keys(obj, pose_keys)
-                    for key_pair in key_pair_list:
-                        start_time = key_pair[0]
-                        stop_time = key_pair[1]
-                        start_value = key_pair[2]
-                        stop_value = key_pair[3]
-                        cmds.keyTangent(obj, inTangentType='linear', outTangentType='linear', e=1,
-                                        time=(start_time, start_time))
-                        cmds.keyTangent(obj, inTangentType='linear', outTangentType='linear', e=1,
-                                        time=(stop_time, stop_time))
-                        span_values = evaluate_key_values_for_key_pair_timespan(obj, start_time, stop_time)
-                        set_layer_as_preferred(pose_layer)
-                        frac_values, total_base_layer_change = get_change_values_frac(span_values)
-                        total_pose_layer_change = abs(stop_value - start_value)
-                        previous_value = start_value
-                        for index, value in enumerate(frac_values):
-                            current_t = value[0]
-                            value_delta = (total_pose_layer_change) * value[1]
-                            base_value = span_values[index][1]
-                            if stop_value > start_value:
-                                current_value = previous_value + value_delta
-                            else:
-                                current_value = previous_value - value_delta
-                            cmds.setKeyframe(obj, animLayer=pose_layer, value=current_value + base_value,
-                                             t=(current_t, current_t))
-                            previous_value = current_value
+                    pose_curve_name = pose_curve_fn.name()
+                    key_pairs = get_key_pairs_from_keys(pose_curve_fn, pose_keys)
+                    pose_times, pose_values = get_adjustment_blend_values(base_curve_fn, key_pairs)
+                    set_key_values_for_timespan(pose_curve_fn, pose_times, pose_values)
+                    # Every pose key is the start or stop of a key pair, so they all get linear tangents in one edit.
+                    cmds.keyTangent(pose_curve_name, inTangentType='linear', outTangentType='linear', e=1,
+                                    time=[(key_time, key_time) for key_time in pose_keys])
+        if standalone:
+            set_layer_as_preferred(pose_layer, layers)
 
 
 def adjustment_blend_character(character=None):
     """
     The main adjustment blending function for running it on an entire character.
+    The whole pass goes into one undo chunk with viewport refresh and the evaluation manager switched off.
     """
     if not character:
         character = cmds.ls(type='character')[0]
     if character:
-        character_objs = cmds.character(f'{character}', query=True)
+        character_objs = cmds.character(character, query=True)
         if character_objs:
-            if len(get_all_layers()) > 1:
-                for obj in character_objs:
-                    if obj:
-                        adjustment_blend_object(obj)
+            layers = get_all_layers()
+            if len(layers) > 1:
+                root_layer = layers[0]
+                pose_layer = layers[-1]
+                evaluation_mode = cmds.evaluationManager(q=True, mode=True)[0]
+                # Each piece is only restored once it has actually been set up.
+                cmds.undoInfo(openChunk=True)
+                try:
+                    cmds.evaluationManager(mode='off')
+                    try:
+                        cmds.refresh(suspend=True)
+                        try:
+                            for obj in character_objs:
+                                if obj:
+                                    adjustment_blend_object(obj, layers, root_layer, pose_layer)
+                            set_layer_as_preferred(pose_layer, layers)
+                        finally:
+                            cmds.refresh(suspend=False)
+                    finally:
+                        cmds.evaluationManager(mode=evaluation_mode)
+                finally:
+                    cmds.undoInfo(closeChunk=True)
         else:
             om.MGlobal.displayWarning("No additive layer found. Adjustment blending affects interpolation between keys on the topmost additive layer.")
     else: